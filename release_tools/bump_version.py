@@ -18,16 +18,25 @@ regular expressions match content of the files to modify.
 
 """
 
+import os
 import re
 import sys
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import date
+from functools import lru_cache
+from mmap import ACCESS_READ, mmap
 from pathlib import Path
-from typing import Dict, List, Match, Optional, Tuple
+from shutil import copyfileobj
+from typing import Dict, List, Match, Optional, Pattern, Sequence, Tuple, Union
 from warnings import warn
 
 import click
-import requests
 from packaging.version import Version
+from requests.adapters import HTTPAdapter
+from requests_cache.session import CachedSession
+from urllib3.util.retry import Retry
 
 if sys.version_info >= (3, 8):
     from typing import TypedDict
@@ -37,6 +46,20 @@ else:
 
 VERSION_PY_PATH = "src/darker/version.py"
 
+# The GitHub API response cache. Expired responses are revalidated with a conditional
+# request using the `ETag` of the cached response, so an unchanged milestone list only
+# costs a `304 Not Modified` round trip which doesn't count against the rate limit.
+GITHUB_CACHE_PATH = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "darker"
+    / "github"
+)
+
+GITHUB_API_HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+}
+
 
 # Below are the regular expression patterns for finding and replacing version and
 # milestone numbers in files. Keys are file paths relative to the repository root.
@@ -108,37 +131,63 @@ def bump_version(  # pylint: disable=too-many-locals
     dry_run: bool, increment_major: bool, increment_minor: bool, token: Optional[str]
 ) -> None:
     """Bump the version number"""
-    (patterns, replacements, new_version) = get_replacements(
-        increment_major,
-        increment_minor,
-        token,
-        dry_run,
-    )
-    for path_str, pattern_templates in PATTERNS.items():
-        path = Path(path_str)
-        content = path.read_text(encoding="utf-8")
-        for pattern_template in pattern_templates:
-            # example: pattern_template == r"darker/{any_milestone->next_milestone}"
-            template_match = CAPTURE_RE.search(pattern_template)
-            if not template_match:
-                raise NoMatch("Can't find `{CAPTURE_RE}` in `{pattern_template}`")
-            current_pattern, replacement = lookup_patterns(
-                template_match, patterns, replacements
-            )
-            # example: current_pattern == "14", replacement == "15"
-            pattern = replace_spans(
-                [template_match.span()], f"({current_pattern})", pattern_template
+    # Fetch the milestones from the GitHub API while the files to modify are being
+    # read, and then patch and write the files in parallel threads.
+    with ThreadPoolExecutor(max_workers=len(PATTERNS) + 1) as executor:
+        # `get_milestone_numbers()` is memoized, so `get_replacements()` reuses this
+        milestones_future = executor.submit(get_milestone_numbers, token)
+        read_futures = {
+            path_str: executor.submit(Path(path_str).read_text, encoding="utf-8")
+            for path_str in PATTERNS
+        }
+        milestones_future.result()
+        (patterns, replacements, new_version) = get_replacements(
+            increment_major,
+            increment_minor,
+            token,
+            dry_run,
+        )
+        compiled_patterns = build_compiled_patterns(patterns, replacements)
+        patch_futures = {
+            path_str: executor.submit(
+                process_file,
+                path_str,
+                read_future.result(),
+                compiled_patterns[path_str],
+                dry_run,
             )
-            # example: pattern = r"darker/(14)"
-            content = replace_group_1(pattern, replacement, content, path=path_str)
-        if dry_run:
-            print(f"\n######## {path_str} ########\n")
-            print(content)
-        else:
-            path.write_text(content, encoding="utf-8")
+            for path_str, read_future in read_futures.items()
+        }
+        for path_str, patch_future in patch_futures.items():
+            content = patch_future.result()
+            if dry_run:
+                print(f"\n######## {path_str} ########\n")
+                print(content)
     patch_changelog(new_version, dry_run)
 
 
+def process_file(
+    path_str: str,
+    content: str,
+    pattern_replacements: List[Tuple["SearchPattern", str]],
+    dry_run: bool,
+) -> str:
+    """Patch version and milestone numbers in the content of a file and save it
+
+    :param path_str: The path of the file relative to the repository root
+    :param content: The current content of the file
+    :param pattern_replacements: Search patterns and the strings to replace their first
+                                 capture groups with
+    :param dry_run: `True` to not write the modified content back to the file
+    :return: The modified content of the file
+
+    """
+    content = replace_groups_1(pattern_replacements, content, path=path_str)
+    if not dry_run:
+        Path(path_str).write_text(content, encoding="utf-8")
+    return content
+
+
 class PatternDict(TypedDict):
     r"""Patterns for old and new version and the milestone number for the new version
 
@@ -208,9 +257,8 @@ def get_replacements(
     old_version = get_current_version()
     new_version = get_next_version(old_version, increment_major, increment_minor)
     milestone_numbers = get_milestone_numbers(token)
-    next_version = get_next_milestone_version(new_version, milestone_numbers, dry_run)
-    if dry_run:
-        milestone_numbers.setdefault(next_version, "MISSING_MILESTONE")
+    milestone_versions = sorted(milestone_numbers)
+    next_version = get_next_milestone_version(new_version, milestone_versions, dry_run)
     patterns: PatternDict = {
         "any_version": r"\d+(?:\.\d+)*",
         "old_version": re.escape(str(old_version)),
@@ -220,7 +268,8 @@ def get_replacements(
     replacements: ReplacementDict = {
         "new_version": str(new_version),
         "next_version": str(next_version),
-        "next_milestone": milestone_numbers[next_version],
+        # `next_version` is always a milestone version unless running in dry-run mode
+        "next_milestone": milestone_numbers.get(next_version, "MISSING_MILESTONE"),
     }
     return patterns, replacements, new_version
 
@@ -273,19 +322,49 @@ def get_next_version(
     return Version(f"{major}.{minor}.{micro + 1}")
 
 
+@lru_cache(maxsize=1)
+def get_github_session() -> CachedSession:
+    """Return a caching GitHub API session which reuses its connection
+
+    The session is created only once per process. It retries requests which fail
+    because of a connection error or a transient server error.
+
+    :return: The HTTP session for GitHub API requests
+
+    """
+    GITHUB_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    session = CachedSession(
+        str(GITHUB_CACHE_PATH), backend="sqlite", cache_control=True, expire_after=3600
+    )
+    session.headers.update(GITHUB_API_HEADERS)
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504))
+    session.mount(
+        "https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry)
+    )
+    return session
+
+
+@lru_cache(maxsize=1)
 def get_milestone_numbers(token: Optional[str]) -> Dict[Version, str]:
     """Fetch milestone names and numbers from the GitHub API
 
+    Responses are cached in `GITHUB_CACHE_PATH` and revalidated using their `ETag`.
+    Within one process, the result is memoized and must not be modified by callers.
+
     :param token: The GitHub access token to use, or `None` to use none
     :return: Milestone names as version numbers, and corresponding milestone numbers
     :raises TypeError: Raised on unexpected JSON response
 
     """
-    milestones = requests.get(
-        "https://api.github.com/repos/akaihola/darker/milestones",
-        headers={"Authorization": f"Bearer {token}"} if token else {},
-        timeout=10,
-    ).json()
+    milestones = (
+        get_github_session()
+        .get(
+            "https://api.github.com/repos/akaihola/darker/milestones",
+            headers={"Authorization": f"Bearer {token}"} if token else {},
+            timeout=(3.05, 10),
+        )
+        .json()
+    )
     if not isinstance(milestones, list):
         raise TypeError(f"Expected a JSON list from GitHub API, got {milestones}")
     # Extract milestone numbers from the milestone titles. Titles are expected to be
@@ -351,21 +430,142 @@ def lookup_patterns(
     return current_pattern, replacement
 
 
+@dataclass(frozen=True)
+class LiteralPattern:
+    """A search pattern with no regular expression syntax except a leading `^`
+
+    Such patterns are searched for using `str.find` instead of the regex engine.
+
+    """
+
+    prefix: str
+    group: str
+    suffix: str
+    at_line_start: bool
+
+    @property
+    def pattern(self) -> str:
+        """Return the search pattern as a regular expression string, for messages"""
+        anchor = "^" if self.at_line_start else ""
+        prefix, group, suffix = (
+            SPECIAL_CHARACTER_RE.sub(r"\\\g<0>", part)
+            for part in (self.prefix, self.group, self.suffix)
+        )
+        return f"{anchor}{prefix}({group}){suffix}"
+
+
+SearchPattern = Union[Pattern[str], LiteralPattern]
+
+
+SPECIAL_CHARACTER_RE = re.compile(r"[\\.^$*+?{}\[\]|()]")
+LITERAL_RE = re.compile(r"(?:[^\\.^$*+?{}\[\]|()]|\\\W)*")
+
+
+def regex_to_literal(pattern: str) -> Optional[str]:
+    r"""Convert a regular expression to a literal string if it has no special syntax
+
+    >>> regex_to_literal(r"darker~=1\.7\.2 isort")
+    'darker~=1.7.2 isort'
+    >>> regex_to_literal(r"rev: \d+") is None
+    True
+
+    :param pattern: The regular expression to convert
+    :return: The literal string matched by the regular expression, or `None` if the
+             regular expression contains special syntax other than escaped characters
+
+    """
+    if not LITERAL_RE.fullmatch(pattern):
+        return None
+    return re.sub(r"\\(\W)", r"\1", pattern)
+
+
+def build_literal_pattern(
+    prefix: str, current_pattern: str, suffix: str
+) -> Optional[LiteralPattern]:
+    r"""Build a literal search pattern from regular expression parts if possible
+
+    >>> build_literal_pattern(r"^  rev: ", r"1\.7\.2", "")
+    LiteralPattern(prefix='  rev: ', group='1.7.2', suffix='', at_line_start=True)
+    >>> build_literal_pattern(r"^     (?:   )?rev: ", r"1\.7\.2", "") is None
+    True
+
+    :param prefix: The regular expression before the capture group
+    :param current_pattern: The regular expression inside the capture group
+    :param suffix: The regular expression after the capture group
+    :return: The literal search pattern, or `None` if the parts contain special syntax
+
+    """
+    at_line_start = prefix.startswith("^")
+    literal_prefix = regex_to_literal(prefix[1:] if at_line_start else prefix)
+    group = regex_to_literal(current_pattern)
+    literal_suffix = regex_to_literal(suffix)
+    if literal_prefix is None or group is None or literal_suffix is None:
+        return None
+    return LiteralPattern(literal_prefix, group, literal_suffix, at_line_start)
+
+
+def build_compiled_patterns(
+    patterns: PatternDict, replacements: ReplacementDict
+) -> Dict[str, List[Tuple[SearchPattern, str]]]:
+    """Compile the search patterns in `PATTERNS` and pair them with replacements
+
+    Each `{OLD->NEW}` template in `PATTERNS` is parsed only once. Templates which turn
+    out to be plain text become `LiteralPattern` objects, and the rest are compiled into
+    regular expressions before any file is read.
+
+    :param patterns: The regular expression patterns corresponding to pattern names
+    :param replacements: The replacement strings corresponding to replacement names
+    :return: Compiled patterns and their replacement strings for each file path
+    :raises NoMatch: Raised if a template doesn't contain an `{OLD->NEW}` expression
+
+    """
+    result: Dict[str, List[Tuple[SearchPattern, str]]] = {}
+    for path_str, pattern_templates in PATTERNS.items():
+        result[path_str] = []
+        for pattern_template in pattern_templates:
+            # example: pattern_template == r"darker/{any_milestone->next_milestone}"
+            template_match = CAPTURE_RE.search(pattern_template)
+            if not template_match:
+                raise NoMatch(f"Can't find `{CAPTURE_RE}` in `{pattern_template}`")
+            current_pattern, replacement = lookup_patterns(
+                template_match, patterns, replacements
+            )
+            # example: current_pattern == "14", replacement == "15"
+            start, end = template_match.span()
+            literal_pattern = build_literal_pattern(
+                pattern_template[:start], current_pattern, pattern_template[end:]
+            )
+            if literal_pattern:
+                result[path_str].append((literal_pattern, replacement))
+                continue
+            pattern = replace_spans(
+                [template_match.span()], f"({current_pattern})", pattern_template
+            )
+            # example: pattern = r"darker/(14)"
+            result[path_str].append((re.compile(pattern, re.MULTILINE), replacement))
+    return result
+
+
 def get_next_milestone_version(
-    version: Version, milestone_numbers: Dict[Version, str], dry_run: bool
+    version: Version, milestone_versions: Sequence[Version], dry_run: bool
 ) -> Version:
     """Get the next larger version number found among milestone names
 
     :param version: The version number to search a larger one for
-    :param milestone_numbers: Milestone names and numbers from the GitHub API
+    :param milestone_versions: Milestone names from the GitHub API as version numbers,
+                               sorted in ascending order
     :param dry_run: `True` if running in dry-run mode
     :return: The next larger version number found
     :raises RuntimeError: Raised if no larger version number could be found
 
+    >>> milestones = [Version("1.1.0"), Version("1.2.0")]
+    >>> get_next_milestone_version(Version("1.1.0"), milestones, dry_run=False)
+    <Version('1.2.0')>
+
     """
-    for milestone_version in sorted(milestone_numbers):
-        if milestone_version > version:
-            return milestone_version
+    index = bisect_right(milestone_versions, version)
+    if index < len(milestone_versions):
+        return milestone_versions[index]
     message = f"No milestone exists for a version later than {version}"
     if not dry_run:
         raise RuntimeError(message)
@@ -385,7 +585,7 @@ def replace_spans(spans: List[Tuple[int, int]], replacement: str, content: str)
     '__BAR__BAR__'
 
     """
-    parts = []
+    parts: List[str] = []
     for (_, end1), (start2, end2) in zip(
         [(..., 0)] + spans, spans + [(len(content), ...)]
     ):
@@ -395,55 +595,149 @@ def replace_spans(spans: List[Tuple[int, int]], replacement: str, content: str)
     return "".join(parts)
 
 
-def replace_group_1(pattern: str, replacement: str, content: str, path: str) -> str:
-    """Replace the first capture group of a regex pattern with the given string
+def find_group_1_spans(pattern: SearchPattern, content: str) -> List[Tuple[int, int]]:
+    r"""Find the spans of the first capture group of all matches of a search pattern
 
-    Raises an exception if the regular expression doesn't match.
+    >>> find_group_1_spans(LiteralPattern("v", "1", "", True), "v1 v1\nv1")
+    [(1, 2), (7, 8)]
 
-    :param pattern: The regular expression pattern with at least one capture group
-    :param replacement: The string to replace the capture group with
-    :param content: The content to search and do the replacement in
-    :param path: The originating file path for the content. Only used in the exception
-                 message if the regular expression doesn't find any matches.
-    :raises NoMatch: Raised if the regular expression doesn't find any matches
-    :return: The resulting content after the replacement
+    :param pattern: A literal search pattern, or a compiled regular expression with at
+                    least one capture group
+    :param content: The content to search in
+    :return: The start and end indices of the first capture group in each match
 
     """
-    matches = re.finditer(pattern, content, flags=re.MULTILINE)
-    if not matches:
-        raise NoMatch(f"Can't find `{pattern}` in `{path}`")
-    return replace_spans([match.span(1) for match in matches], replacement, content)
+    if not isinstance(pattern, LiteralPattern):
+        return [match.span(1) for match in pattern.finditer(content)]
+    needle = f"{pattern.prefix}{pattern.group}{pattern.suffix}"
+    spans = []
+    position = content.find(needle)
+    while position != -1:
+        if pattern.at_line_start and position > 0 and content[position - 1] != "\n":
+            position = content.find(needle, position + 1)
+            continue
+        group_start = position + len(pattern.prefix)
+        spans.append((group_start, group_start + len(pattern.group)))
+        position = content.find(needle, position + len(needle))
+    return spans
+
+
+def replace_groups_1(
+    pattern_replacements: List[Tuple[SearchPattern, str]], content: str, path: str
+) -> str:
+    r"""Replace the first capture group of each regex pattern with the given string
+
+    All patterns are matched against the original content, and the result is built in
+    a single pass. Warns about patterns which don't match.
+
+    >>> replace_groups_1(
+    ...     [(re.compile(r"v(\d)"), "2"), (re.compile(r"m(\d)"), "9")],
+    ...     "v1 m8 v1",
+    ...     path="example.txt",
+    ... )
+    'v2 m9 v2'
+    >>> replace_groups_1(
+    ...     [(re.compile(r"v(\d\.\d)"), "2.0"), (re.compile(r"\.(\d)"), "9")],
+    ...     "v1.1",
+    ...     path="example.txt",
+    ... )
+    Traceback (most recent call last):
+      ...
+    RuntimeError: Overlapping replacements for `1.1` and `1` in `example.txt`
+
+    :param pattern_replacements: Search patterns and the strings to replace their first
+                                 capture groups with
+    :param content: The content to search and do the replacements in
+    :param path: The originating file path for the content. Used in warning and error
+                 messages.
+    :raises RuntimeError: Raised if the capture groups of two patterns overlap, or if
+                          the same capture group has different replacements
+    :return: The resulting content after the replacements
+
+    """
+    replacements_by_span: Dict[Tuple[int, int], str] = {}
+    for pattern, replacement in pattern_replacements:
+        spans = find_group_1_spans(pattern, content)
+        if not spans:
+            warn(f"Can't find `{pattern.pattern}` in `{path}`")
+        for span in spans:
+            if replacements_by_span.setdefault(span, replacement) != replacement:
+                raise RuntimeError(
+                    f"Conflicting replacements for `{content[slice(*span)]}`"
+                    f" in `{path}`"
+                )
+    parts: List[str] = []
+    previous_start, end = 0, 0
+    for (start, next_end), replacement in sorted(replacements_by_span.items()):
+        if start < end:
+            raise RuntimeError(
+                f"Overlapping replacements for `{content[previous_start:end]}` and"
+                f" `{content[start:next_end]}` in `{path}`"
+            )
+        parts.extend((content[end:start], replacement))
+        previous_start, end = start, next_end
+    parts.append(content[end:])
+    return "".join(parts)
 
 
 def patch_changelog(next_version: Version, dry_run: bool) -> None:
     """Insert the new version and create a new unreleased section in the change log
 
+    The change log is streamed into a temporary file which then replaces the original,
+    so the whole file is never decoded or held in memory as a string. Both LF and CRLF
+    line endings are supported, and the new section uses the line endings of the file.
+
     :param next_version: The next version after the new version
     :param dry_run: `True` to just print the result
+    :raises NoMatch: Raised if the unreleased section can't be found
 
     """
     path = Path("CHANGES.rst")
-    content = path.read_text(encoding="utf-8")
-    before_unreleased = "These features will be included in the next release:\n\n"
-    insert_point = content.index(before_unreleased) + len(before_unreleased)
-    before = content[:insert_point]
-    after = content[insert_point:]
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    unreleased_intro = b"These features will be included in the next release:"
     title = f"{next_version}_ - {date.today()}"
-    new_content = (
-        f"{before}"
-        "Added\n"
-        "-----\n\n"
-        "Fixed\n"
-        "-----\n\n\n"
-        f"{title}\n"
-        f"{len(title) * '='}\n\n"
-        f"{after}"
-    )
-    if dry_run:
-        print("######## CHANGES.rst ########")
-        print(new_content[:200])
-    else:
-        path.write_text(new_content, encoding="utf-8")
+    new_section_lines = [
+        "Added",
+        "-----",
+        "",
+        "Fixed",
+        "-----",
+        "",
+        "",
+        title,
+        len(title) * "=",
+        "",
+        "",
+    ]
+    with path.open("rb") as changelog:
+        with mmap(changelog.fileno(), 0, access=ACCESS_READ) as content:
+            for newline in (b"\n", b"\r\n"):
+                before_unreleased = unreleased_intro + 2 * newline
+                position = content.find(before_unreleased)
+                if position != -1:
+                    break
+            else:
+                raise NoMatch(f"Can't find `{unreleased_intro!r}` in `{path}`")
+            new_section = newline.join(
+                line.encode("utf-8") for line in new_section_lines
+            )
+            insert_point = position + len(before_unreleased)
+            if dry_run:
+                head = content[:insert_point] + new_section + content[insert_point:200]
+                print("######## CHANGES.rst ########")
+                print(head[:200].decode("utf-8", errors="replace"))
+                return
+            try:
+                with tmp_path.open("wb") as new_changelog:
+                    new_changelog.write(content[:insert_point])
+                    new_changelog.write(new_section)
+                    changelog.seek(insert_point)
+                    copyfileobj(changelog, new_changelog, length=1 << 20)
+            except BaseException:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+                raise
+    os.replace(tmp_path, path)
 
 
 if __name__ == "__main__":